@@ -1,25 +1,41 @@
 import os
+import shutil
 import tempfile
 import platform
 
 # Base directories
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-UPLOADS_DIR = os.path.join(tempfile.gettempdir(), 'dynamic_dock_uploads')
-RESULTS_DIR = os.path.join(tempfile.gettempdir(), 'dynamic_dock_results')
+
+# Keep working files on RAM-backed /dev/shm when available (Linux), else the system temp dir.
+# Fetched structures, their clean receptors and docking results are not cleaned up
+# automatically, so a small /dev/shm (Docker's default is 64 MB) is not used.
+SHM_DIR = '/dev/shm'
+SHM_MIN_FREE = 1 << 30  # 1 GiB
+
+def _shm_usable() -> bool:
+    if not (os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK)):
+        return False
+    return shutil.disk_usage(SHM_DIR).free >= SHM_MIN_FREE
+
+TMP_ROOT = SHM_DIR if _shm_usable() else tempfile.gettempdir()
+
+UPLOADS_DIR = os.path.join(TMP_ROOT, 'dynamic_dock_uploads')
+RESULTS_DIR = os.path.join(TMP_ROOT, 'dynamic_dock_results')
+# Fetched structures and per-request ligand files
+WORK_DIR = os.path.join(TMP_ROOT, 'dynamic_dock_work')
 
 # Create directories if they don't exist
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
+os.makedirs(WORK_DIR, exist_ok=True)
 
 # Vina path based on platform
 system = platform.system().lower()
 if system == 'darwin':  # macOS
     VINA_PATH = os.path.join(BASE_DIR, 'bin', 'mac', 'vina')
+    VINA_SHA256 = '7b75677976f337d6375f3d5e1c0d17b95feae9480b37937086bca2bdeeb7cbbc'
 elif system == 'linux':
     VINA_PATH = os.path.join(BASE_DIR, 'bin', 'linux', 'vina')
+    VINA_SHA256 = 'd08893d2c807bc880a71f82efb775c36b5a43e4bdbc89202b60c956f09d5cb57'
 else:
     raise RuntimeError(f"Unsupported platform: {system}")
-
-# Ensure Vina exists and is executable
-if os.path.exists(VINA_PATH):
-    os.chmod(VINA_PATH, 0o755)  # Make executable
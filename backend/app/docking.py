@@ -4,16 +4,107 @@ Handles AutoDock Vina docking operations and result processing.
 """
 
 import os
+import re
+import asyncio
+import logging
 import tempfile
 import subprocess
-from typing import Dict, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import json
+import importlib.util
 from pathlib import Path
 
+# The vina Python bindings are optional; without them every run uses the vina binary.
+# They are only imported when a VinaSession is built: importing them before
+# openbabel's bindings aborts the process, so the module must not load them eagerly.
+HAS_VINA_BINDINGS = importlib.util.find_spec("vina") is not None
+
+logger = logging.getLogger(__name__)
+
+# One "REMARK VINA RESULT: affinity rmsd_lb rmsd_ub" line per binding mode
+VINA_RESULT_RE = re.compile(
+    rb"REMARK VINA RESULT:\s+(-?\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+\.?\d*)"
+)
+
+def _pdbqt_atom_to_pdb(line: bytes) -> bytes:
+    """
+    Convert a PDBQT ATOM record to PDB format.
+    Removes the charge and AutoDock type columns, keeping only the element.
+    """
+    return line[:66] + b'  1.00  0.00           ' + line[77:78] + b'\n'
+
+def _first_pose_to_pdb(pdbqt_path: str) -> bytes:
+    """
+    Convert the ATOM records of the first (best) pose in a Vina output PDBQT
+    to PDB format, reading and joining the whole block at once.
+    """
+    data = Path(pdbqt_path).read_bytes()
+    end = data.find(b'\nENDMDL')
+    if end >= 0:
+        data = data[:end]
+    return b''.join(
+        _pdbqt_atom_to_pdb(line)
+        for line in data.split(b'\n')
+        if line.startswith(b'ATOM')
+    )
+
+class VinaSession:
+    """
+    Persistent Vina object for one receptor and search box.
+
+    The receptor is loaded and its grid maps computed once, so every ligand
+    docked through the session only pays for the search itself.
+    """
+    def __init__(
+        self,
+        receptor_path: str,
+        center: Tuple[float, float, float],
+        box_size: Tuple[float, float, float],
+        cpu: int = 0
+    ):
+        from vina import Vina
+
+        self.vina = Vina(sf_name="vina", cpu=cpu, verbosity=0)
+        self.vina.set_receptor(rigid_pdbqt_filename=receptor_path)
+        self.vina.compute_vina_maps(center=list(center), box_size=list(box_size))
+        self.lock = threading.Lock()
+
+    def dock(
+        self,
+        ligand_path: str,
+        output_path: str,
+        exhaustiveness: int = 8,
+        num_modes: int = 9
+    ) -> None:
+        """Dock one ligand against the preloaded maps and write its poses."""
+        with self.lock:
+            self.vina.set_ligand_from_file(ligand_path)
+            self.vina.dock(exhaustiveness=exhaustiveness, n_poses=num_modes)
+            self.vina.write_poses(output_path, n_poses=num_modes, overwrite=True)
+
 class DockingHandler:
-    def __init__(self, vina_executable: str = "vina"):
+    def __init__(
+        self,
+        vina_executable: str = "vina",
+        temp_root: Optional[str] = None,
+        vina_cpu: Optional[int] = None
+    ):
         self.vina_executable = vina_executable
-        self.temp_dir = tempfile.mkdtemp(prefix='docking_')
+        # Threads per Vina run from run_docking_async; the default of all cores means one run at a time
+        self.vina_cpu = vina_cpu or os.cpu_count() or 1
+        self.temp_dir = tempfile.mkdtemp(prefix='dynamic_dock_', dir=temp_root)
+        self._batch_supported: Optional[bool] = None
+        self._sessions: Dict[Tuple, VinaSession] = {}
+        # Sessions are looked up from executor threads; one lock covers lookup, creation and eviction
+        self._sessions_lock = threading.Lock()
+        self.max_sessions = 4
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._receptor_blobs: Dict[Tuple[str, float], bytes] = {}
+        # save_docked_complex runs on threadpool threads
+        self._receptor_blobs_lock = threading.Lock()
+        self.max_receptor_blobs = 4
 
     def prepare_docking_config(
         self,
@@ -25,158 +116,385 @@ class DockingHandler:
         size_z: float = 20.0,
         exhaustiveness: int = 8,
         num_modes: int = 9
-    ) -> str:
+    ) -> List[str]:
         """
-        Prepare AutoDock Vina configuration file.
+        Prepare AutoDock Vina search options as command-line flags.
+        Vina accepts every option on the command line, so no config file is written.
         """
-        config_path = os.path.join(self.temp_dir, "config.txt")
-        
-        config = {
-            "center_x": center_x,
-            "center_y": center_y,
-            "center_z": center_z,
-            "size_x": size_x,
-            "size_y": size_y,
-            "size_z": size_z,
-            "exhaustiveness": exhaustiveness,
-            "num_modes": num_modes
-        }
-        
-        with open(config_path, 'w') as f:
-            for key, value in config.items():
-                f.write(f"{key} = {value}\n")
-        
-        return config_path
+        return [
+            "--center_x", str(center_x),
+            "--center_y", str(center_y),
+            "--center_z", str(center_z),
+            "--size_x", str(size_x),
+            "--size_y", str(size_y),
+            "--size_z", str(size_z),
+            "--exhaustiveness", str(exhaustiveness),
+            "--num_modes", str(num_modes)
+        ]
 
     def run_docking(
         self,
         receptor_path: str,
         ligand_path: str,
-        config_path: str,
-        output_path: Optional[str] = None
+        config_args: List[str],
+        output_path: Optional[str] = None,
+        cpu: Optional[int] = None
     ) -> Dict:
         """
         Run molecular docking using AutoDock Vina.
         """
         if output_path is None:
-            output_path = os.path.join(self.temp_dir, "output.pdbqt")
+            output_path = self._new_output_path()
+
+        if HAS_VINA_BINDINGS:
+            return self._run_docking_session(receptor_path, ligand_path, config_args, output_path)
 
         try:
-            cmd = [
-                self.vina_executable,
-                "--receptor", receptor_path,
-                "--ligand", ligand_path,
-                "--config", config_path,
-                "--out", output_path
-            ]
-            
-            print("Running command:", " ".join(cmd))  # Debug print
+            cmd = self._vina_command(receptor_path, ligand_path, config_args, output_path, cpu)
+            logger.debug("Running command: %s", " ".join(cmd))
             
-            process = subprocess.Popen(
+            process = subprocess.run(
                 cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE
             )
             
-            stdout, stderr = process.communicate()
+            return self._docking_result(process.returncode, process.stderr, output_path)
             
-            if process.returncode != 0:
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    async def run_docking_async(
+        self,
+        receptor_path: str,
+        ligand_path: str,
+        config_args: List[str],
+        output_path: Optional[str] = None,
+        cpu: Optional[int] = None
+    ) -> Dict:
+        """
+        Run molecular docking without blocking the event loop.
+
+        Vina runs as an asyncio subprocess with cpu threads (vina_cpu by
+        default), and at most cpu_count // vina_cpu runs are started at a time
+        so concurrent requests do not oversubscribe the machine. The Python
+        bindings are never used here: Vina.dock() holds the GIL for the whole
+        search, which would stall the event loop even from an executor thread.
+        """
+        if output_path is None:
+            output_path = self._new_output_path()
+
+        # Created lazily so the semaphore binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, (os.cpu_count() or 1) // self.vina_cpu))
+        if cpu is None:
+            cpu = self.vina_cpu
+
+        async with self._semaphore:
+            try:
+                cmd = self._vina_command(receptor_path, ligand_path, config_args, output_path, cpu)
+                logger.debug("Running command: %s", " ".join(cmd))
+
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                _, stderr = await process.communicate()
+
+                return self._docking_result(process.returncode, stderr, output_path)
+
+            except Exception as e:
                 return {
                     "success": False,
-                    "error": f"Vina error: {stderr}"
+                    "error": str(e)
                 }
-            
-            # Parse scores from stdout
-            scores = []
-            reading_scores = False
-            
-            for line in stdout.split('\n'):
-                # Start reading scores after this marker
-                if "-----+------------+----------+----------" in line:
-                    reading_scores = True
-                    continue
-                
-                # Stop reading when we hit an empty line after scores
-                if reading_scores and not line.strip():
-                    break
-                
-                # Parse score lines
-                if reading_scores and line.strip():
-                    try:
-                        parts = line.split()
-                        if len(parts) >= 4:  # mode, affinity, rmsd l.b., rmsd u.b.
-                            scores.append({
-                                "mode": int(parts[0]),
-                                "affinity": float(parts[1]),
-                                "rmsd_lb": float(parts[2]),
-                                "rmsd_ub": float(parts[3])
-                            })
-                    except (IndexError, ValueError) as e:
-                        print(f"Error parsing line: {line}, Error: {str(e)}")
-                        continue
-            
-            print(f"Parsed {len(scores)} binding modes")  # Debug print
-            for score in scores:
-                print(f"Mode {score['mode']}: {score['affinity']} kcal/mol")  # Debug print
-            
+
+    def _new_output_path(self) -> str:
+        """Reserve a unique pose file in the handler's temp dir for one docking run."""
+        with tempfile.NamedTemporaryFile(delete=False, dir=self.temp_dir, suffix="_out.pdbqt") as tf:
+            return tf.name
+
+    def _vina_command(
+        self,
+        receptor_path: str,
+        ligand_path: str,
+        config_args: List[str],
+        output_path: str,
+        cpu: Optional[int] = None
+    ) -> List[str]:
+        """Build the Vina command line for a single ligand."""
+        cmd = [
+            self.vina_executable,
+            "--receptor", receptor_path,
+            "--ligand", ligand_path,
+            *config_args,
+            "--out", output_path
+        ]
+        if cpu is not None:
+            cmd += ["--cpu", str(cpu)]
+        return cmd
+
+    def _docking_result(self, returncode: int, stderr: bytes, output_path: str) -> Dict:
+        """Turn a finished Vina run into the result dict returned by run_docking."""
+        if returncode != 0:
             return {
-                "success": True,
-                "scores": scores,
-                "output_path": output_path
+                "success": False,
+                "error": f"Vina error: {stderr.decode(errors='replace')}"
             }
-            
+        
+        # Vina writes the same scores as REMARK lines in the output file
+        scores = self._parse_vina_pdbqt(output_path)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Parsed %d binding modes", len(scores))
+            for score in scores:
+                logger.debug("Mode %d: %s kcal/mol", score["mode"], score["affinity"])
+        
+        return {
+            "success": True,
+            "scores": scores,
+            "output_path": output_path
+        }
+
+    def run_docking_batch(
+        self,
+        receptor_path: str,
+        ligand_paths: List[str],
+        config_args: List[str],
+        output_dir: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Dock several ligands against the same receptor.
+
+        On Vina 1.2+ all ligands go through a single ``--batch`` invocation so
+        the receptor grid maps are only built once. A single ligand, or a Vina
+        binary without batch support, falls back to one ``run_docking`` call
+        per ligand. Poses are written to ``<ligand>_out.pdbqt`` in output_dir.
+        """
+        if output_dir is None:
+            output_dir = self.temp_dir
+
+        output_paths = [self._batch_output_path(path, output_dir) for path in ligand_paths]
+
+        # A Vina session already shares grid maps between ligands in-process
+        if len(ligand_paths) == 1 or HAS_VINA_BINDINGS or not self._supports_batch():
+            return [
+                self.run_docking(receptor_path, ligand_path, config_args, output_path)
+                for ligand_path, output_path in zip(ligand_paths, output_paths)
+            ]
+
+        try:
+            cmd = [
+                self.vina_executable,
+                "--receptor", receptor_path,
+                *config_args,
+                "--batch", *ligand_paths,
+                "--dir", output_dir
+            ]
+
+            process = subprocess.run(
+                cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE
+            )
+
+            if process.returncode != 0:
+                error = f"Vina error: {process.stderr.decode(errors='replace')}"
+                return [{"success": False, "error": error} for _ in ligand_paths]
+
+            results = []
+            for output_path in output_paths:
+                if not os.path.exists(output_path):
+                    results.append({
+                        "success": False,
+                        "error": f"Vina produced no output at {output_path}"
+                    })
+                    continue
+                results.append({
+                    "success": True,
+                    "scores": self._parse_vina_pdbqt(output_path),
+                    "output_path": output_path
+                })
+            return results
+
+        except Exception as e:
+            return [{"success": False, "error": str(e)} for _ in ligand_paths]
+
+    def run_docking_many(
+        self,
+        receptor_path: str,
+        ligand_paths: List[str],
+        config_args: List[str],
+        output_dir: Optional[str] = None,
+        n_workers: Optional[int] = None,
+        vina_cpu: int = 1
+    ) -> List[Dict]:
+        """
+        Dock several ligands concurrently, one Vina process per ligand.
+
+        Each Vina process is limited to vina_cpu threads and by default
+        cpu_count // vina_cpu of them run at once, which keeps all cores busy
+        on screening workloads better than Vina's per-ligand threading does.
+        A single ligand, or a run through the Vina Python bindings (which
+        share one session per receptor), is docked sequentially without a pool.
+        """
+        if output_dir is None:
+            output_dir = self.temp_dir
+
+        output_paths = [self._batch_output_path(path, output_dir) for path in ligand_paths]
+
+        if len(ligand_paths) == 1 or HAS_VINA_BINDINGS:
+            return [
+                self.run_docking(receptor_path, ligand_path, config_args, output_path)
+                for ligand_path, output_path in zip(ligand_paths, output_paths)
+            ]
+
+        if n_workers is None:
+            n_workers = max(1, (os.cpu_count() or 1) // vina_cpu)
+
+        def dock_one(paths):
+            ligand_path, output_path = paths
+            return self.run_docking(
+                receptor_path, ligand_path, config_args, output_path, cpu=vina_cpu
+            )
+
+        # Vina does the work in its own process, so threads are enough to keep
+        # n_workers of them running without pickling or forking the interpreter.
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(dock_one, zip(ligand_paths, output_paths)))
+
+    def _run_docking_session(
+        self,
+        receptor_path: str,
+        ligand_path: str,
+        config_args: List[str],
+        output_path: str
+    ) -> Dict:
+        """Dock through the Vina Python bindings, reusing maps for the same receptor and box."""
+        try:
+            config = self._read_config(config_args)
+            center = (config["center_x"], config["center_y"], config["center_z"])
+            box_size = (config["size_x"], config["size_y"], config["size_z"])
+            key = (receptor_path, os.path.getmtime(receptor_path), center, box_size)
+
+            with self._sessions_lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    # Drop the oldest receptor's maps before loading a new one
+                    if len(self._sessions) >= self.max_sessions:
+                        self._sessions.pop(next(iter(self._sessions)))
+                    session = self._sessions[key] = VinaSession(
+                        receptor_path, center, box_size, cpu=self.vina_cpu
+                    )
+
+            session.dock(
+                ligand_path,
+                output_path,
+                exhaustiveness=int(config.get("exhaustiveness", 8)),
+                num_modes=int(config.get("num_modes", 9))
+            )
+            # Read the scores back from the pose file so both paths return the same fields
+            return self._docking_result(0, b"", output_path)
+
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e)
             }
 
+    @staticmethod
+    def _read_config(config_args: List[str]) -> Dict[str, float]:
+        """Turn the flags built by prepare_docking_config back into named values."""
+        return {
+            flag.lstrip("-"): float(value)
+            for flag, value in zip(config_args[::2], config_args[1::2])
+        }
+
+    def _supports_batch(self) -> bool:
+        """Check once whether the Vina binary understands ``--batch`` (Vina 1.2+)."""
+        if self._batch_supported is None:
+            try:
+                process = subprocess.run(
+                    [self.vina_executable, "--version"],
+                    capture_output=True,
+                    text=True
+                )
+                match = re.search(r"(\d+)\.(\d+)", process.stdout)
+                self._batch_supported = bool(match) and (
+                    (int(match.group(1)), int(match.group(2))) >= (1, 2)
+                )
+            except OSError:
+                self._batch_supported = False
+        return self._batch_supported
+
+    @staticmethod
+    def _batch_output_path(ligand_path: str, output_dir: str) -> str:
+        """Output file name Vina's ``--dir`` mode uses for a given ligand."""
+        return os.path.join(output_dir, f"{Path(ligand_path).stem}_out.pdbqt")
+
+    @staticmethod
+    def _parse_vina_pdbqt(output_path: str) -> List[Dict]:
+        """Read binding mode scores from the REMARK lines of a Vina output PDBQT."""
+        scores = []
+        with open(output_path, 'rb') as f:
+            for line in f:
+                if not line.startswith(b"REMARK VINA RESULT:"):
+                    continue
+                match = VINA_RESULT_RE.match(line)
+                if match:
+                    scores.append({
+                        "mode": len(scores) + 1,
+                        "affinity": float(match[1]),
+                        "rmsd_lb": float(match[2]),
+                        "rmsd_ub": float(match[3])
+                    })
+        return scores
+
     def save_docked_complex(self, receptor_path, docked_ligand_path, output_path):
         """
         Generate a PDB file containing both the receptor and the best docked pose.
         """
         try:
-            # Read the receptor PDB file
-            with open(receptor_path, 'r') as f:
-                receptor_lines = f.readlines()
-
-            # Read the docked ligand PDBQT file (we'll only use the first/best pose)
-            with open(docked_ligand_path, 'r') as f:
-                ligand_lines = []
-                reading_model = False
-                for line in f:
-                    if line.startswith('MODEL 1'):
-                        reading_model = True
-                        continue
-                    elif line.startswith('MODEL ') or line.startswith('ENDMDL'):
-                        reading_model = False
-                        continue
-                    elif reading_model and line.startswith('ATOM'):
-                        # Convert PDBQT atom lines to PDB format
-                        # Remove charge columns and keep only essential PDB fields
-                        pdb_line = line[:66] + '  1.00  0.00           ' + line[77:78] + '\n'
-                        ligand_lines.append(pdb_line)
-
             # Write the combined PDB file
-            with open(output_path, 'w') as f:
-                # Write receptor atoms
-                for line in receptor_lines:
-                    if not line.startswith('END'):
-                        f.write(line)
+            with open(output_path, 'wb') as f:
+                # Write receptor atoms as one block
+                f.write(self._receptor_blob(receptor_path))
                 
-                # Write ligand atoms
-                f.write('TER\n')  # Terminate receptor chain
-                for line in ligand_lines:
-                    f.write(line)
-                f.write('END\n')
+                # Write ligand atoms (we'll only use the first/best pose)
+                f.write(b'TER\n')  # Terminate receptor chain
+                f.write(_first_pose_to_pdb(docked_ligand_path))
+                f.write(b'END\n')
 
             return output_path
 
         except Exception as e:
-            print(f"Error generating complex PDB: {str(e)}")
+            logger.error("Error generating complex PDB: %s", e)
             return None
 
+    def _receptor_blob(self, receptor_path: str) -> bytes:
+        """
+        Receptor PDB contents without the closing END record.
+        Cached per (path, mtime), since many poses are saved against one receptor.
+        """
+        key = (receptor_path, os.path.getmtime(receptor_path))
+        with self._receptor_blobs_lock:
+            blob = self._receptor_blobs.get(key)
+        if blob is None:
+            # Read outside the lock; a concurrent miss on the same key only costs a second read
+            data = Path(receptor_path).read_bytes()
+            end = data.rfind(b'\nEND')
+            blob = data if end < 0 or data[end + 1:end + 7] == b'ENDMDL' else data[:end + 1]
+
+            with self._receptor_blobs_lock:
+                if key not in self._receptor_blobs and len(self._receptor_blobs) >= self.max_receptor_blobs:
+                    self._receptor_blobs.pop(next(iter(self._receptor_blobs)))
+                self._receptor_blobs[key] = blob
+        return blob
+
     def prepare_for_md(self, docked_complex_path: str) -> Dict:
         """
         Prepare docked complex for molecular dynamics simulation.
@@ -2,14 +2,24 @@
 Main application module for Dynamic Dock.
 """
 
+import hashlib
+import logging
+import os
+from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from .routes import router
+from . import config
+
+# Set LOG_LEVEL=DEBUG to see per-run debug output (Vina commands, parsed scores)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
 app = FastAPI(
     title="Dynamic Dock API",
     description="A molecular docking platform that enables protein-ligand docking analysis",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse
 )
 
 # Enable CORS
@@ -22,15 +32,41 @@ app.add_middleware(
         "https://dynamicdock.onrender.com"
     ],
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["content-type", "authorization"],
     expose_headers=["*"],
-    max_age=3600
+    max_age=86400  # Let browsers cache preflight results for a day
 )
 
 # Include routes
 app.include_router(router, prefix="/api")
 
+@app.on_event("startup")
+def prepare_vina():
+    """
+    Verify the bundled Vina binary against its pinned SHA-256 and make it executable.
+    A sentinel file next to the binary records a successful check, so later
+    workers and restarts skip the hash.
+    """
+    sentinel = config.VINA_PATH + ".ok"
+    if os.path.exists(sentinel) and os.path.getmtime(sentinel) >= os.path.getmtime(config.VINA_PATH):
+        return
+
+    digest = hashlib.sha256()
+    with open(config.VINA_PATH, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    if digest.hexdigest() != config.VINA_SHA256:
+        raise RuntimeError(f"AutoDock Vina at {config.VINA_PATH} does not match the expected SHA-256")
+
+    if not os.access(config.VINA_PATH, os.X_OK):
+        os.chmod(config.VINA_PATH, 0o755)
+
+    try:
+        Path(sentinel).touch()
+    except OSError:
+        pass  # Read-only install; the check simply runs again next start
+
 @app.get("/")
 async def root():
     """Root endpoint."""
@@ -5,52 +5,204 @@ Handles protein structure analysis, ligand detection, and docking operations.
 
 from typing import Dict, List, Optional, Tuple
 import os
+import sys
+import logging
 import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 import numpy as np
 from Bio import PDB
-from Bio.PDB import PDBIO, Select
 import subprocess
 from rdkit import Chem
-from rdkit.Chem import AllChem
+from rdkit.Chem import AllChem, rdDetermineBonds
+from rdkit.Geometry import Point3D
 
-class LigandSelect(Select):
-    """Selector class for saving specific residues."""
-    def __init__(self, residue):
-        self.residue = residue
+try:
+    from meeko import MoleculePreparation, PDBQTWriterLegacy
+except ImportError:  # Meeko is optional; ligands fall back to the obabel CLI
+    MoleculePreparation = None
 
-    def accept_residue(self, residue):
-        return residue == self.residue
+try:
+    from openbabel import pybel
+except ImportError:  # Without the Python bindings, receptors go through the obabel CLI
+    pybel = None
+
+logger = logging.getLogger(__name__)
+
+# Canonical SMILES for common cofactors; bonds guessed from coordinates
+# cannot recover their bond orders, so these are used directly.
+KNOWN_LIGAND_SMILES = {
+    'ATP': 'Nc1ncnc2c1ncn2[C@@H]1O[C@H](COP(=O)(O)OP(=O)(O)OP(=O)(O)O)[C@@H](O)[C@H]1O',
+    'ADP': 'Nc1ncnc2c1ncn2[C@@H]1O[C@H](COP(=O)(O)OP(=O)(O)O)[C@@H](O)[C@H]1O',
+    'GTP': 'Nc1nc2c(ncn2[C@@H]2O[C@H](COP(=O)(O)OP(=O)(O)OP(=O)(O)O)[C@@H](O)[C@H]2O)c(=O)[nH]1',
+    'GDP': 'Nc1nc2c(ncn2[C@@H]2O[C@H](COP(=O)(O)OP(=O)(O)O)[C@@H](O)[C@H]2O)c(=O)[nH]1',
+}
+
+# Residue name sets are interned so lookups with interned resnames compare by identity
+# Standard amino acids kept in the clean protein structure
+PROTEIN_RESIDUES = frozenset(map(sys.intern, (
+    'GLY', 'ALA', 'VAL', 'LEU', 'ILE', 'PRO', 'PHE', 'TYR', 'TRP',
+    'SER', 'THR', 'CYS', 'MET', 'ASN', 'GLN', 'ASP', 'GLU', 'LYS',
+    'ARG', 'HIS',
+)))
+
+# Water and ions kept in the clean protein structure
+IMPORTANT_IONS = frozenset(map(sys.intern, ('HOH', 'WAT', 'SOL', 'CL', 'NA', 'MG', 'CA', 'ZN', 'FE')))
+
+# Everything else is stripped from the clean protein structure
+KEEP_RESIDUES = PROTEIN_RESIDUES | IMPORTANT_IONS
+
+# Common non-ligand hetero molecules, never reported as ligands
+EXCLUDED_RESIDUES = frozenset(map(sys.intern, ('HOH', 'WAT', 'SOL', 'CL', 'NA', 'MG', 'CA', 'ZN')))
+
+# Byte forms of the kept residue names, for filtering raw PDB lines
+_IMPORTANT_IONS_BYTES = frozenset(name.encode() for name in IMPORTANT_IONS)
+_KEEP_RESIDUES_BYTES = frozenset(name.encode() for name in KEEP_RESIDUES)
+
+# Below this many new residues, SMILES are generated in-process; a pool only pays off for larger batches
+PARALLEL_SMILES_MIN = 8
+
+def rdkit_worker_init() -> None:
+    """Process pool initializer: load RDKit's lazily imported parts once per worker."""
+    Chem.MolFromSmiles('C')
+    AllChem.ETKDGv3()
+
+@lru_cache(maxsize=1)
+def _smiles_pool() -> ProcessPoolExecutor:
+    """Fallback process pool for handlers created without one, started on first use."""
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=rdkit_worker_init)
+
+@lru_cache(maxsize=2)
+def _parse_structure(structure_path: str, mtime_ns: int, size: int):
+    """
+    Parse a structure file; mtime and size are part of the cache key so edits force a re-parse.
+    Parsed structures can be large, so only the last two are kept (e.g. a re-fetched PDB ID).
+    A fresh parser per call keeps concurrent requests from sharing its builder state.
+    """
+    return PDB.PDBParser(QUIET=True).get_structure("structure", structure_path)
+
+def _atoms_to_rwmol(elements: np.ndarray, coords: np.ndarray) -> Optional[Chem.RWMol]:
+    """Build an RDKit molecule in memory from atoms, with bonds inferred from 3D distances."""
+    if not len(elements):
+        return None
+    
+    mol = Chem.RWMol()
+    conformer = Chem.Conformer(len(elements))
+    for i, (element, (x, y, z)) in enumerate(zip(elements, coords)):
+        mol.AddAtom(Chem.Atom(element))
+        conformer.SetAtomPosition(i, Point3D(float(x), float(y), float(z)))
+    mol.AddConformer(conformer, assignId=True)
+    
+    # Proximity bonding, as RDKit does for PDB input without CONECT records
+    rdDetermineBonds.DetermineConnectivity(mol)
+    for atom in mol.GetAtoms():
+        # Hydrogens are usually absent from PDB ligands; let RDKit fill them in
+        atom.SetNoImplicit(False)
+        atom.SetNumRadicalElectrons(0)
+    return mol
+
+def _smiles_from_atoms(resname: str, elements: np.ndarray, coords: np.ndarray) -> Optional[str]:
+    """Convert a residue's atoms to SMILES format using RDKit."""
+    try:
+        mol = _atoms_to_rwmol(elements, coords)
+        if mol is None:
+            logger.debug("Failed to create RDKit mol for %s", resname)
+            return None
+            
+        # Try to sanitize the molecule
+        try:
+            Chem.SanitizeMol(mol)
+        except Exception as e:
+            logger.debug("Failed to sanitize %s: %s", resname, e)
+            return None
+        
+        Chem.AssignStereochemistryFrom3D(mol)
+        return Chem.MolToSmiles(mol)
+        
+    except Exception as e:
+        logger.debug("Error in _smiles_from_atoms for %s: %s", resname, e)
+        return None
+
+def _optimize_ligand(mol: Chem.Mol, method: str) -> None:
+    """Relax the embedded ligand; Vina refines torsions itself, so a short run is enough."""
+    if method == 'none':
+        return
+    if method == 'mmff':
+        try:
+            # Returns -1 when MMFF has no parameters for the molecule
+            if AllChem.MMFFOptimizeMolecule(mol, maxIters=50) != -1:
+                return
+        except Exception as e:
+            logger.debug("MMFF optimization failed, falling back to UFF: %s", e)
+    AllChem.UFFOptimizeMolecule(mol, maxIters=50)
+
+def _embed_ligand(smiles: str, optimize: str) -> Chem.Mol:
+    """3D structure with hydrogens for a SMILES string; runs in a worker process when a pool is given."""
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        raise RuntimeError(f"Failed to parse SMILES: {smiles}")
+    
+    mol = Chem.AddHs(mol)
+    params = AllChem.ETKDGv3()
+    params.randomSeed = 42
+    AllChem.EmbedMolecule(mol, params)
+    _optimize_ligand(mol, optimize)
+    return mol
+
+def _pybel_receptor_to_pdbqt(pdb_path: str, pdbqt_path: str) -> None:
+    """Convert a receptor PDB to rigid PDBQT with pybel; run in a worker process, as it holds the GIL."""
+    receptor = next(pybel.readfile('pdb', pdb_path), None)
+    if receptor is None:
+        raise RuntimeError(f"No molecule could be read from {pdb_path}")
+    receptor.write('pdbqt', pdbqt_path, overwrite=True, opt={'r': None})
 
 class MolecularHandler:
-    def __init__(self):
+    def __init__(self, pool: Optional[ProcessPoolExecutor] = None, temp_root: Optional[str] = None):
+        # Scratch dir for fetched structures and ligand PDBQTs
+        self.temp_dir = temp_root or tempfile.gettempdir()
+        # Worker processes for RDKit work; without one, SMILES batches use a lazily started pool
+        self._pool = pool
         self.parser = PDB.PDBParser(QUIET=True)
         self.pdbl = PDB.PDBList()
-        self.io = PDBIO()
+        self._pdbqt_cache: Dict[Tuple[str, float], str] = {}
+        self.max_pdbqt_cache = 64
+        # prepare_for_docking runs on threadpool threads
+        self._pdbqt_cache_lock = threading.Lock()
+        # Force field used to relax embedded ligands: 'uff', 'mmff' or 'none'.
+        # With Meeko the ETKDG geometry goes straight to PDBQT and Vina refines it,
+        # so relaxation is skipped unless asked for.
+        default_optimize = 'none' if MoleculePreparation is not None else 'uff'
+        self.ligand_optimize = os.getenv('DD_LIGAND_OPT', default_optimize).lower()
 
     def fetch_structure(self, pdb_id: str) -> str:
         """Fetch a PDB structure from the PDB database."""
         pdb_path = self.pdbl.retrieve_pdb_file(
             pdb_id,
-            pdir=tempfile.gettempdir(),
+            pdir=self.temp_dir,
             file_format="pdb"
         )
         return pdb_path
 
     def analyze_structure(self, structure_path: str) -> Dict:
         """Analyze a PDB structure and return information about ligands and binding sites."""
-        structure = self.parser.get_structure("structure", structure_path)
-        ligands = self._find_ligands(structure)
+        structure = self._get_structure(structure_path)
+        ligands = self._scan_structure(structure)
         
         # Only determine active site if ligands were found
         active_site = self._determine_active_site(ligands) if ligands else {}
         
         # Create clean structure only if ligands were found
-        clean_structure_path = self._remove_ligands(structure, structure_path) if ligands else structure_path
+        clean_structure_path = (
+            self._remove_ligands(structure_path)
+            if ligands else structure_path
+        )
         
-        print(f"Found {len(ligands)} ligands")  # Debug print
-        if ligands:
-            print(f"Main ligand: {ligands[0]}")  # Debug print
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Found %d ligands", len(ligands))
+            if ligands:
+                logger.debug("Main ligand: %s", ligands[0])
         
         return {
             "ligands": ligands,
@@ -58,50 +210,69 @@ class MolecularHandler:
             "clean_structure_path": clean_structure_path
         }
 
-    def _find_ligands(self, structure) -> List[Dict]:
-        """Find ligands in the structure."""
+    def _get_structure(self, structure_path: str):
+        """Parse a structure file, reusing the parsed object while the file is unchanged."""
+        st = os.stat(structure_path)
+        return _parse_structure(structure_path, st.st_mtime_ns, st.st_size)
+
+    def _scan_structure(self, structure) -> List[Dict]:
+        """Find ligands in the structure, largest first, marking the main ligand."""
         ligands = []
-        excluded_residues = {'HOH', 'WAT', 'SOL', 'CL', 'NA', 'MG', 'CA', 'ZN'}  # Common non-ligand hetero molecules
+        debug = logger.isEnabledFor(logging.DEBUG)
+        candidates = []
         
         for model in structure:
             for chain in model:
+                chain_id = chain.id
                 for residue in chain:
+                    # Read each residue attribute once
+                    resname = sys.intern(residue.resname)
+                    rid = residue.id
+                    is_het = bool(rid[0].strip())
+                    
                     # Check if it's a hetero residue and not water/ions
-                    if residue.id[0].strip() and residue.resname not in excluded_residues:
+                    if is_het and resname not in EXCLUDED_RESIDUES:
                         try:
-                            # Get coordinates first
-                            coords = self._get_centroid(residue)
-                            if not coords:
-                                continue
-                                
-                            # Try to get SMILES
-                            smiles = self._get_smiles(residue)
-                            if not smiles:
+                            # One walk over the atoms; the arrays serve the count, centroid and SMILES
+                            names, elements, atom_coords = self._residue_arrays(residue)
+                            heavy = elements != 'H'
+                            atom_count = int(heavy.sum())
+                            # Only keep if more than 3 non-hydrogen atoms; smaller fragments never get SMILES
+                            if atom_count <= 3:
                                 continue
-                            
-                            # Count non-hydrogen atoms
-                            atom_count = len([atom for atom in residue if not atom.name.startswith('H')])
-                            
-                            if atom_count > 3:  # Only include if more than 3 non-hydrogen atoms
-                                ligand_info = {
-                                    "name": residue.resname,
-                                    "chain": chain.id,
-                                    "position": residue.id[1],
-                                    "coordinates": {
-                                        "x": coords[0],
-                                        "y": coords[1],
-                                        "z": coords[2]
-                                    },
-                                    "smiles": smiles,
-                                    "atoms": atom_count,
-                                    "residue_id": residue.id
-                                }
-                                ligands.append(ligand_info)
-                                print(f"Found ligand: {residue.resname} with {atom_count} atoms")  # Debug print
+                            coords = self._get_centroid(atom_coords[heavy])
+                            candidates.append((
+                                chain_id, resname, rid, coords, atom_count,
+                                (resname, names, elements, atom_coords)
+                            ))
                         except Exception as e:
-                            print(f"Error processing residue {residue.resname}: {str(e)}")  # Debug print
+                            logger.debug("Error processing residue %s: %s", resname, e)
                             continue
         
+        # Convert all candidates to SMILES together so cache misses can run in parallel
+        all_smiles = self._get_smiles_many([arrays for *_, arrays in candidates])
+        
+        for (chain_id, resname, rid, coords, atom_count, _), smiles in zip(candidates, all_smiles):
+            if not smiles:
+                continue
+            
+            ligand_info = {
+                "name": resname,
+                "chain": chain_id,
+                "position": rid[1],
+                "coordinates": {
+                    "x": coords[0],
+                    "y": coords[1],
+                    "z": coords[2]
+                },
+                "smiles": smiles,
+                "atoms": atom_count,
+                "residue_id": rid
+            }
+            ligands.append(ligand_info)
+            if debug:
+                logger.debug("Found ligand: %s with %d atoms", resname, atom_count)
+        
         # Sort ligands by size (number of atoms) to identify the main ligand
         ligands.sort(key=lambda x: x["atoms"], reverse=True)
         if ligands:
@@ -109,46 +280,56 @@ class MolecularHandler:
         
         return ligands
 
-    def _get_centroid(self, residue) -> Optional[List[float]]:
-        """Calculate the centroid of a residue."""
-        coords = []
-        for atom in residue:
-            if not atom.name.startswith('H'):  # Exclude hydrogens
-                coords.append(atom.get_coord())
-        if not coords:
-            return None
-        return np.mean(coords, axis=0).tolist()
+    def _get_centroid(self, coords: np.ndarray) -> Optional[List[float]]:
+        """Calculate the centroid of a set of atom coordinates."""
+        return coords.mean(axis=0).tolist() if coords.size else None
 
-    def _get_smiles(self, residue) -> Optional[str]:
-        """Convert a residue to SMILES format using RDKit."""
-        try:
-            # Create a temporary PDB file for just this residue
-            temp_pdb = tempfile.mktemp(suffix='.pdb')
-            self.io.set_structure(residue.get_parent().get_parent())
-            self.io.save(temp_pdb, LigandSelect(residue))
-            
-            # Try to convert to SMILES using RDKit
-            mol = Chem.MolFromPDBFile(temp_pdb, removeHs=False, sanitize=False)
-            if mol is None:
-                print(f"Failed to create RDKit mol for {residue.resname}")  # Debug print
-                return None
-                
-            # Try to sanitize the molecule
-            try:
-                Chem.SanitizeMol(mol)
-            except Exception as e:
-                print(f"Failed to sanitize {residue.resname}: {str(e)}")  # Debug print
-                return None
-            
-            smiles = Chem.MolToSmiles(mol)
-            os.remove(temp_pdb)
-            return smiles
-            
-        except Exception as e:
-            print(f"Error in _get_smiles for {residue.resname}: {str(e)}")  # Debug print
-            if os.path.exists(temp_pdb):
-                os.remove(temp_pdb)
-            return None
+    def _get_smiles_many(
+        self,
+        residue_arrays: List[Tuple[str, Tuple[str, ...], np.ndarray, np.ndarray]]
+    ) -> List[Optional[str]]:
+        """
+        Convert residues of one structure, given as (resname, names, elements,
+        coords) from _residue_arrays, to SMILES format.
+        Copies of the same residue type with the same atoms share one RDKit
+        conversion; larger batches of new residues are spread over a process pool.
+        Results are not kept across structures: generic names such as LIG or UNL
+        with matching atom names can stand for different molecules in different files.
+        """
+        keys = [(resname, tuple(sorted(names))) for resname, names, _, _ in residue_arrays]
+        
+        misses = {}
+        for key, (resname, _, elements, coords) in zip(keys, residue_arrays):
+            if key[0] not in KNOWN_LIGAND_SMILES and key not in misses:
+                misses[key] = (resname, elements, coords)
+        
+        if len(misses) >= PARALLEL_SMILES_MIN:
+            resnames, elements, coords = zip(*misses.values())
+            pool = self._pool or _smiles_pool()
+            results = list(pool.map(_smiles_from_atoms, resnames, elements, coords, chunksize=8))
+        else:
+            results = [_smiles_from_atoms(*atoms) for atoms in misses.values()]
+        smiles_by_key = dict(zip(misses, results))
+        
+        return [
+            KNOWN_LIGAND_SMILES[key[0]] if key[0] in KNOWN_LIGAND_SMILES else smiles_by_key[key]
+            for key in keys
+        ]
+
+    @staticmethod
+    def _residue_arrays(residue) -> Tuple[Tuple[str, ...], np.ndarray, np.ndarray]:
+        """
+        Atom names, elements and (n, 3) coordinates of a residue, gathered in one
+        walk over its atoms. The arrays are picklable for SMILES workers.
+        """
+        atoms = residue.child_list
+        names = tuple(atom.get_name() for atom in atoms)
+        elements = np.array([
+            (atom.element if atom.element and atom.element != 'X' else atom.get_name()[0]).capitalize()
+            for atom in atoms
+        ])
+        coords = np.array([atom.coord for atom in atoms], dtype=np.float32).reshape(-1, 3)
+        return names, elements, coords
 
     def _determine_active_site(self, ligands: List[Dict]) -> Dict:
         """Determine the active site based on the main ligand position."""
@@ -157,7 +338,7 @@ class MolecularHandler:
         
         # Use the largest ligand (first in the sorted list) as the main ligand
         main_ligand = ligands[0]
-        print(f"Using {main_ligand['name']} as main ligand for active site")  # Debug print
+        logger.debug("Using %s as main ligand for active site", main_ligand['name'])
         
         return {
             "x": main_ligand["coordinates"]["x"],
@@ -167,45 +348,45 @@ class MolecularHandler:
             "ligand_smiles": main_ligand["smiles"]
         }
 
-    def _remove_ligands(self, structure, original_path: str) -> str:
-        """Remove ligands from the structure and save a clean version."""
-        clean_structure = structure.copy()
-        
-        # Define residues to keep (protein residues and important ions)
-        protein_residues = {'GLY', 'ALA', 'VAL', 'LEU', 'ILE', 'PRO', 'PHE', 'TYR', 'TRP', 
-                          'SER', 'THR', 'CYS', 'MET', 'ASN', 'GLN', 'ASP', 'GLU', 'LYS', 
-                          'ARG', 'HIS'}
-        important_ions = {'HOH', 'WAT', 'SOL', 'CL', 'NA', 'MG', 'CA', 'ZN', 'FE'}
-        keep_residues = protein_residues.union(important_ions)
-        
-        # Identify residues to remove
-        residues_to_remove = []
-        for model in clean_structure:
-            for chain in model:
-                for residue in chain:
-                    # Remove if it's a hetero residue (has 'H_' prefix) or not in keep_residues
-                    if (residue.id[0].strip() and residue.resname not in important_ions) or \
-                       (residue.resname not in keep_residues):
-                        residues_to_remove.append((chain.id, residue.id))
-        
-        print(f"Removing {len(residues_to_remove)} ligands/non-protein residues from structure")  # Debug print
-        
-        # Remove the identified residues
-        for chain_id, residue_id in residues_to_remove:
-            try:
-                chain = clean_structure[0][chain_id]
-                chain.detach_child(residue_id)
-                print(f"Removed residue {residue_id} from chain {chain_id}")  # Debug print
-            except Exception as e:
-                print(f"Error removing residue {residue_id} from chain {chain_id}: {str(e)}")  # Debug print
-                continue
+    def _remove_ligands(self, original_path: str) -> str:
+        """
+        Remove ligands from a PDB file and save a clean version.
+        Records are judged line by line, so no parsed structure is needed.
+        """
+        logger.debug("Removing ligands/non-protein residues from %s", original_path)
         
         # Save the clean structure
-        clean_path = original_path.replace('.pdb', '_clean.pdb')
-        self.io.set_structure(clean_structure)
-        self.io.save(clean_path)
+        # Derive the name from the extension so fetched .ent files never overwrite themselves
+        clean_path = os.path.splitext(original_path)[0] + '_clean.pdb'
+        self._write_clean_pdb_stream(original_path, clean_path)
         
-        print(f"Saved clean structure to {clean_path}")  # Debug print
+        logger.debug("Saved clean structure to %s", clean_path)
+        return clean_path
+
+    @staticmethod
+    def _is_removable_record(line: bytes) -> bool:
+        """Hetero records other than water/ions, or any residue that is neither protein nor water/ion."""
+        resname = line[17:20].strip()
+        if not resname:  # Bare TER record
+            return False
+        return (line.startswith(b'HETATM') and resname not in _IMPORTANT_IONS_BYTES) or \
+               (resname not in _KEEP_RESIDUES_BYTES)
+
+    def _write_clean_pdb_stream(self, original_path: str, clean_path: str) -> str:
+        """
+        Copy the coordinate records of a PDB file, skipping every record
+        _is_removable_record rejects.
+        Lines are filtered as raw bytes, so nothing is re-formatted through Bio.PDB.
+        """
+        with open(original_path, 'rb') as src, open(clean_path, 'wb') as dst:
+            for line in src:
+                record = line[:6].rstrip()
+                if record in (b'ATOM', b'HETATM', b'TER'):
+                    if self._is_removable_record(line):
+                        continue
+                    dst.write(line)
+                elif record in (b'MODEL', b'ENDMDL', b'END'):
+                    dst.write(line)
         return clean_path
 
     def prepare_for_docking(self, protein_path: str, ligand_smiles: str) -> Tuple[str, str]:
@@ -213,70 +394,85 @@ class MolecularHandler:
         try:
             # First, ensure we're using a structure without ligands
             if not protein_path.endswith('_clean.pdb'):
-                # Load the structure
-                structure = self.parser.get_structure("structure", protein_path)
-                # Remove ligands and save clean structure
-                protein_path = self._remove_ligands(structure, protein_path)
-                print(f"Created clean protein structure at: {protein_path}")  # Debug print
+                # Remove ligands and save clean structure, straight from the file
+                protein_path = self._remove_ligands(protein_path)
+                logger.debug("Created clean protein structure at: %s", protein_path)
             
             # Convert clean protein to PDBQT
             protein_pdbqt = self._convert_to_pdbqt(protein_path)
-            print(f"Converted protein to PDBQT: {protein_pdbqt}")  # Debug print
+            logger.debug("Converted protein to PDBQT: %s", protein_pdbqt)
             
             # Convert ligand SMILES to PDBQT
             ligand_pdbqt = self._prepare_ligand(ligand_smiles)
-            print(f"Prepared ligand PDBQT: {ligand_pdbqt}")  # Debug print
+            logger.debug("Prepared ligand PDBQT: %s", ligand_pdbqt)
             
             return protein_pdbqt, ligand_pdbqt
             
         except Exception as e:
-            print(f"Error in prepare_for_docking: {str(e)}")  # Debug print
+            logger.error("Error in prepare_for_docking: %s", e)
             raise RuntimeError(f"Failed to prepare structures for docking: {str(e)}")
 
     def _convert_to_pdbqt(self, pdb_path: str) -> str:
         """Convert PDB to PDBQT format for AutoDock Vina using OpenBabel."""
+        # Reuse the conversion while the receptor file is unchanged
+        key = (pdb_path, os.path.getmtime(pdb_path))
+        with self._pdbqt_cache_lock:
+            cached = self._pdbqt_cache.get(key)
+        if cached is not None and os.path.exists(cached):
+            return cached
+
         pdbqt_path = pdb_path.replace('.pdb', '.pdbqt')
         try:
-            cmd = ['obabel', pdb_path, '-O', pdbqt_path, '-xr']
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
-            if not os.path.exists(pdbqt_path):
-                raise RuntimeError(f"Failed to create PDBQT file at {pdbqt_path}")
+            if pybel is not None and self._pool is not None:
+                # Convert in an already running worker instead of starting an obabel subprocess
+                self._pool.submit(_pybel_receptor_to_pdbqt, pdb_path, pdbqt_path).result()
+            else:
+                cmd = ['obabel', pdb_path, '-O', pdbqt_path, '-xr']
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            with self._pdbqt_cache_lock:
+                # Drop the oldest receptor once the cache is full
+                if key not in self._pdbqt_cache and len(self._pdbqt_cache) >= self.max_pdbqt_cache:
+                    self._pdbqt_cache.pop(next(iter(self._pdbqt_cache)))
+                self._pdbqt_cache[key] = pdbqt_path
             return pdbqt_path
         except subprocess.CalledProcessError as e:
-            print(f"Error converting to PDBQT: {e.output}")
+            logger.error("Error converting to PDBQT: %s", e.stderr.decode(errors='replace'))
             raise RuntimeError(f"Failed to convert {pdb_path} to PDBQT format")
 
     def _prepare_ligand(self, smiles: str) -> str:
-        """Prepare ligand for docking from SMILES using RDKit and OpenBabel."""
+        """Prepare ligand for docking from SMILES using RDKit and Meeko (or OpenBabel)."""
         try:
-            # Convert SMILES to 3D structure
-            mol = Chem.MolFromSmiles(smiles)
-            if mol is None:
-                raise RuntimeError(f"Failed to parse SMILES: {smiles}")
-            
-            mol = Chem.AddHs(mol)
-            AllChem.EmbedMolecule(mol, randomSeed=42)
-            AllChem.MMFFOptimizeMolecule(mol)
+            # Convert SMILES to 3D structure, in a worker process when the handler has a pool
+            if self._pool is not None:
+                mol = self._pool.submit(_embed_ligand, smiles, self.ligand_optimize).result()
+            else:
+                mol = _embed_ligand(smiles, self.ligand_optimize)
             
-            # Save as PDB first
-            temp_pdb = tempfile.mktemp(suffix='.pdb')
-            Chem.MolToPDBFile(mol, temp_pdb)
+            if MoleculePreparation is not None:
+                # Write PDBQT straight from the RDKit molecule
+                setups = MoleculePreparation().prepare(mol)
+                pdbqt_string, is_ok, error = PDBQTWriterLegacy.write_string(setups[0])
+                if not is_ok:
+                    raise RuntimeError(f"Meeko could not write PDBQT: {error}")
+                fd, temp_pdbqt = tempfile.mkstemp(suffix='.pdbqt', dir=self.temp_dir)
+                with os.fdopen(fd, 'w') as f:
+                    f.write(pdbqt_string)
+                return temp_pdbqt
             
-            # Convert to PDBQT using OpenBabel
-            temp_pdbqt = temp_pdb.replace('.pdb', '.pdbqt')
-            cmd = ['obabel', temp_pdb, '-O', temp_pdbqt, '-xh']
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
+            # Convert to PDBQT using OpenBabel, piping the PDB block in instead of via a temp file
+            fd, temp_pdbqt = tempfile.mkstemp(suffix='.pdbqt', dir=self.temp_dir)
+            os.close(fd)
+            cmd = ['obabel', '-ipdb', '-O', temp_pdbqt, '-xh']
+            subprocess.run(
+                cmd, input=Chem.MolToPDBBlock(mol).encode(), check=True,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
             
-            # Clean up temporary PDB file
-            os.remove(temp_pdb)
-            
-            if not os.path.exists(temp_pdbqt):
-                raise RuntimeError(f"Failed to create PDBQT file at {temp_pdbqt}")
-                
             return temp_pdbqt
             
+        except subprocess.CalledProcessError as e:
+            logger.error("Error converting ligand to PDBQT: %s", e.stderr.decode(errors='replace'))
+            raise RuntimeError(f"Failed to prepare ligand: {str(e)}")
         except Exception as e:
-            print(f"Error preparing ligand: {str(e)}")
-            if os.path.exists(temp_pdb):
-                os.remove(temp_pdb)
+            logger.error("Error preparing ligand: %s", e)
             raise RuntimeError(f"Failed to prepare ligand: {str(e)}")
@@ -2,27 +2,48 @@
 API routes for Dynamic Dock.
 """
 
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
 from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+import atexit
 import tempfile
 import os
+import stat
+import logging
+import aiofiles
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from typing import Optional
 from pydantic import BaseModel
-from .molecular import MolecularHandler
+from .molecular import MolecularHandler, rdkit_worker_init
 from .docking import DockingHandler
 from . import config
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
-molecular_handler = MolecularHandler()
+
+# RDKit worker processes shared by all requests, started now so no request pays for the spawn
+_pool_workers = os.cpu_count() or 1
+_pool = ProcessPoolExecutor(max_workers=_pool_workers, initializer=rdkit_worker_init)
+for _ in range(_pool_workers):
+    _pool.submit(int)
+atexit.register(_pool.shutdown)
+
+molecular_handler = MolecularHandler(pool=_pool, temp_root=config.WORK_DIR)
 
 # Use path from config
 vina_path = config.VINA_PATH
 if not os.path.exists(vina_path):
     raise RuntimeError(f"AutoDock Vina not found at {vina_path}")
 
-print(f"Using Vina from: {vina_path}")  # Debug print
-docking_handler = DockingHandler(vina_executable=vina_path)
+logger.info("Using Vina from: %s", vina_path)
+
+@lru_cache(maxsize=1)
+def get_docking_handler() -> DockingHandler:
+    """Shared docking handler, so its temp dir and Vina sessions live across requests."""
+    return DockingHandler(vina_executable=vina_path, temp_root=config.WORK_DIR)
 
 class VinaSetupRequest(BaseModel):
     output_dir: str
@@ -52,8 +73,8 @@ async def setup_vina(request: VinaSetupRequest):
 async def fetch_pdb(pdb_id: str):
     """Fetch and analyze a PDB structure."""
     try:
-        structure_path = molecular_handler.fetch_structure(pdb_id)
-        analysis = molecular_handler.analyze_structure(structure_path)
+        structure_path = await run_in_threadpool(molecular_handler.fetch_structure, pdb_id)
+        analysis = await run_in_threadpool(molecular_handler.analyze_structure, structure_path)
         
         # Get the main ligand information
         main_ligand = next((l for l in analysis["ligands"] if "is_main_ligand" in l), None)
@@ -74,11 +95,12 @@ async def upload_pdb(file: UploadFile = File(...)):
     try:
         # Use the uploads directory
         temp_path = os.path.join(config.UPLOADS_DIR, file.filename)
-        with open(temp_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        async with aiofiles.open(temp_path, "wb") as buffer:
+            # Stream in 64 KiB chunks so large structures never sit fully in memory
+            while chunk := await file.read(1 << 16):
+                await buffer.write(chunk)
         
-        analysis = molecular_handler.analyze_structure(temp_path)
+        analysis = await run_in_threadpool(molecular_handler.analyze_structure, temp_path)
         
         # Update the clean structure path to be relative
         if analysis["clean_structure_path"]:
@@ -104,10 +126,15 @@ async def upload_pdb(file: UploadFile = File(...)):
             os.remove(temp_path)
 
 @router.post("/dock")
-async def dock_ligand(request: DockingRequest):
+async def dock_ligand(
+    request: DockingRequest,
+    docking_handler: DockingHandler = Depends(get_docking_handler)
+):
     """Perform molecular docking."""
+    ligand_pdbqt = None
     try:
-        print("Received docking request:", request.dict())  # Debug print
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received docking request: %s", request.dict())
         
         # Use the results directory for output
         output_dir = os.path.join(config.RESULTS_DIR, request.output_dir)
@@ -122,14 +149,15 @@ async def dock_ligand(request: DockingRequest):
             )
         
         # Prepare receptor and ligand
-        protein_pdbqt, ligand_pdbqt = molecular_handler.prepare_for_docking(
+        protein_pdbqt, ligand_pdbqt = await run_in_threadpool(
+            molecular_handler.prepare_for_docking,
             receptor_path, request.ligand_smiles
         )
         
-        print(f"Prepared PDBQT files: Protein: {protein_pdbqt}, Ligand: {ligand_pdbqt}")  # Debug print
+        logger.debug("Prepared PDBQT files: Protein: %s, Ligand: %s", protein_pdbqt, ligand_pdbqt)
         
         # Prepare docking configuration
-        config_path = docking_handler.prepare_docking_config(
+        config_args = docking_handler.prepare_docking_config(
             request.center_x, request.center_y, request.center_z,
             request.size_x, request.size_y, request.size_z
         )
@@ -139,10 +167,10 @@ async def dock_ligand(request: DockingRequest):
         complex_pdb = os.path.join(output_dir, "docked_complex.pdb")
         
         # Run docking
-        result = docking_handler.run_docking(
+        result = await docking_handler.run_docking_async(
             protein_pdbqt,
             ligand_pdbqt,
-            config_path,
+            config_args,
             docking_result_pdbqt
         )
         
@@ -157,15 +185,16 @@ async def dock_ligand(request: DockingRequest):
         binding_affinity = best_score["affinity"] if best_score else None
         
         # Generate the complex PDB file
-        complex_path = docking_handler.save_docked_complex(
+        complex_path = await run_in_threadpool(
+            docking_handler.save_docked_complex,
             receptor_path,  # Original PDB file
             docking_result_pdbqt,  # Docked ligand
             complex_pdb  # Output path
         )
         
-        print(f"Generated complex PDB at: {complex_pdb}")  # Debug log
+        logger.debug("Generated complex PDB at: %s", complex_pdb)
         
-        if not os.path.exists(complex_pdb):
+        if complex_path is None:
             raise HTTPException(
                 status_code=500,
                 detail="Failed to generate complex PDB file"
@@ -178,36 +207,46 @@ async def dock_ligand(request: DockingRequest):
             "complex_path": complex_pdb
         }
         
-        print(f"Sending response with paths: {response_data}")  # Debug log
+        logger.debug("Sending response with paths: %s", response_data)
         return response_data
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # The ligand PDBQT is per request and only needed while Vina runs
+        if ligand_pdbqt and os.path.exists(ligand_pdbqt):
+            os.remove(ligand_pdbqt)
+
+# Directories files may be downloaded from
+_DOWNLOAD_ROOTS = tuple(os.path.abspath(d) for d in (config.UPLOADS_DIR, config.RESULTS_DIR, config.BASE_DIR))
 
 @router.get("/download/{file_path:path}")
 async def download_file(file_path: str):
     """Download a file."""
     try:
-        print(f"Download request for file: {file_path}")  # Debug log
+        logger.debug("Download request for file: %s", file_path)
         
         # Convert relative path to absolute path within our directories
-        if file_path.startswith(config.UPLOADS_DIR) or file_path.startswith(config.RESULTS_DIR):
+        if file_path.startswith((config.UPLOADS_DIR, config.RESULTS_DIR)):
             abs_path = file_path
         else:
             abs_path = os.path.join(config.BASE_DIR, file_path)
         
         abs_path = os.path.abspath(abs_path)
         
-        print(f"Absolute path: {abs_path}")  # Debug log
-        print(f"Allowed directories: {config.UPLOADS_DIR}, {config.RESULTS_DIR}")  # Debug log
+        logger.debug("Absolute path: %s", abs_path)
+        logger.debug("Allowed directories: %s, %s", config.UPLOADS_DIR, config.RESULTS_DIR)
         
         # Security check: ensure file is within allowed directories
-        if not (abs_path.startswith(config.UPLOADS_DIR) or 
-                abs_path.startswith(config.RESULTS_DIR) or
-                abs_path.startswith(config.BASE_DIR)):
+        if not any(os.path.commonpath((abs_path, root)) == root for root in _DOWNLOAD_ROOTS):
             raise HTTPException(status_code=403, detail="Access denied")
-            
-        if not os.path.exists(abs_path):
+        
+        # One stat answers both "does it exist" and "is it a regular file"
+        try:
+            st = os.stat(abs_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
+        if not stat.S_ISREG(st.st_mode):
             raise HTTPException(status_code=404, detail="File not found")
             
         # Get the file name from the path
@@ -226,7 +265,10 @@ async def download_file(file_path: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/prepare-md")
-async def prepare_for_md(docked_complex_path: str):
+async def prepare_for_md(
+    docked_complex_path: str,
+    docking_handler: DockingHandler = Depends(get_docking_handler)
+):
     """Prepare a docked complex for molecular dynamics."""
     try:
         result = docking_handler.prepare_for_md(docked_complex_path)